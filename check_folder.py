@@ -1,6 +1,32 @@
 import os
 from pathlib import Path
 
+
+def iter_csvs(root, suffix='.csv'):
+    """
+    Recursively yield paths of files under root whose name ends with suffix.
+    
+    Walks the tree with os.scandir and an explicit stack, returning plain
+    path strings instead of Path objects.
+    
+    Args:
+        root: Directory to search
+        suffix: File name suffix to match (e.g. '.csv', '_PR.csv')
+    """
+    stack = [os.fspath(root)]
+    while stack:
+        directory = stack.pop()
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.name.endswith(suffix):
+                        yield entry.path
+        except OSError:
+            continue
+
+
 def check_folder_structure():
     """
     Check and display the current folder structure to help debug.
@@ -12,6 +38,23 @@ def check_folder_structure():
     current_dir = Path.cwd()
     print(f"\nCurrent working directory: {current_dir}\n")
     
+    pr_folder = current_dir / 'PR'
+    ghi_folder = current_dir / 'GHI'
+    pr_prefix = os.path.join(pr_folder, '')
+    ghi_prefix = os.path.join(ghi_folder, '')
+    
+    # Walk the tree once and bucket the CSV files for every check below.
+    # The walk does not follow symlinks, so a symlinked PR/GHI folder is
+    # walked as a root of its own.
+    roots = [current_dir] + [f for f in (pr_folder, ghi_folder) if f.is_symlink() and f.is_dir()]
+    pr_files, ghi_files, all_csvs = [], [], []
+    for csv_path in (path for root in roots for path in iter_csvs(root)):
+        all_csvs.append(csv_path)
+        if csv_path.startswith(pr_prefix) and csv_path.endswith('_PR.csv'):
+            pr_files.append(csv_path)
+        elif csv_path.startswith(ghi_prefix) and csv_path.endswith('_GHI.csv'):
+            ghi_files.append(csv_path)
+    
     # List all items in current directory
     print("Contents of current directory:")
     print("-" * 60)
@@ -28,7 +71,6 @@ def check_folder_structure():
     print("\n" + "=" * 60)
     
     # Check for PR folder
-    pr_folder = current_dir / 'PR'
     print("\nChecking PR folder:")
     print("-" * 60)
     if pr_folder.exists():
@@ -45,31 +87,28 @@ def check_folder_structure():
                 print(f"     📄 {csv.name}")
         
         # Count total PR CSV files
-        pr_files = list(pr_folder.rglob('*_PR.csv'))
         print(f"\nTotal PR CSV files found: {len(pr_files)}")
         if pr_files:
             print("\nFirst 5 PR files:")
             for f in pr_files[:5]:
-                print(f"  {f.relative_to(current_dir)}")
+                print(f"  {os.path.relpath(f, current_dir)}")
     else:
         print(f"❌ PR folder NOT found at: {pr_folder}")
     
     print("\n" + "=" * 60)
     
     # Check for GHI folder
-    ghi_folder = current_dir / 'GHI'
     print("\nChecking GHI folder:")
     print("-" * 60)
     if ghi_folder.exists():
         print(f"✅ GHI folder found at: {ghi_folder}")
         
         # Count total GHI CSV files
-        ghi_files = list(ghi_folder.rglob('*_GHI.csv'))
         print(f"\nTotal GHI CSV files found: {len(ghi_files)}")
         if ghi_files:
             print("\nFirst 5 GHI files:")
             for f in ghi_files[:5]:
-                print(f"  {f.relative_to(current_dir)}")
+                print(f"  {os.path.relpath(f, current_dir)}")
     else:
         print(f"❌ GHI folder NOT found at: {ghi_folder}")
     
@@ -79,13 +118,12 @@ def check_folder_structure():
     
     # Check if data might be in a different location
     print("\nSearching for any CSV files in current directory tree...")
-    all_csvs = list(current_dir.rglob('*.csv'))
     print(f"Total CSV files found: {len(all_csvs)}")
     
     if all_csvs:
         print("\nFirst 10 CSV files found:")
         for csv in all_csvs[:10]:
-            print(f"  {csv.relative_to(current_dir)}")
+            print(f"  {os.path.relpath(csv, current_dir)}")
     
     print("\n" + "=" * 60)
 
@@ -2,14 +2,225 @@ import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
 import seaborn as sns
-from pathlib import Path
 from datetime import datetime, timedelta
 import os
+import json
+from concurrent.futures import ThreadPoolExecutor
+from check_folder import iter_csvs
+
+try:
+    import polars as pl
+except ImportError:  # polars is optional, pandas is used when it is missing
+    pl = None
+
+try:
+    from numba import njit
+except ImportError:  # numba is optional, numpy/pandas is used when it is missing
+    njit = None
+
+
+# Accepted Date formats, tried in order: ISO dates, optionally with a time
+DATE_FORMATS = ('%Y-%m-%d', '%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M:%S')
+
+
+def parse_dates(values):
+    """
+    Parse Date strings with the accepted ISO formats (see DATE_FORMATS).
+    
+    Each format is tried with a strict, vectorized parse on the values the
+    previous formats left unparsed; anything else (e.g. '2020/01/02') is NaT.
+    
+    Args:
+        values: Series of date strings
+    
+    Returns:
+        Series of datetimes (NaT for blank or unparseable values)
+    """
+    dates = pd.to_datetime(values, format=DATE_FORMATS[0], errors='coerce')
+    for date_format in DATE_FORMATS[1:]:
+        unparsed = dates.isna() & values.notna()
+        if not unparsed.any():
+            break
+        dates[unparsed] = pd.to_datetime(values[unparsed], format=date_format, errors='coerce')
+    return dates
+
+
+def read_csv_files(files, value_column):
+    """
+    Read Date/value CSV files and stack them into a single DataFrame.
+    
+    Uses the polars multi-file streaming reader when polars is installed and
+    falls back to reading the files with pandas on a thread pool otherwise.
+    Both read Date as text and parse it with parse_dates(), so the result
+    does not depend on which reader was used.
+    
+    Args:
+        files: List of CSV file paths
+        value_column: Name of the value column ('PR' or 'GHI')
+    
+    Returns:
+        DataFrame with columns: Date (datetime, NaT if unparseable),
+        <value_column> (float32)
+    """
+    columns = ['Date', value_column]
+    frame = None
+    
+    if pl is not None and files:
+        try:
+            # The streaming engine parses in fixed-size batches, which bounds
+            # peak memory to roughly one batch per thread on large trees
+            with pl.Config(streaming_chunk_size=50_000):
+                lazy_frame = pl.scan_csv([str(f) for f in files],
+                                         schema_overrides={'Date': pl.String, value_column: pl.Float32})
+                frame = lazy_frame.select(columns).collect(engine='streaming').to_pandas()
+        except Exception as e:
+            print(f"polars could not read {value_column} files ({e}), falling back to pandas")
+    
+    if frame is None:
+        def read_file(csv_file):
+            try:
+                return pd.read_csv(csv_file, usecols=columns,
+                                   dtype={'Date': str, value_column: 'float32'})
+            except Exception as e:
+                print(f"Error processing {csv_file}: {e}")
+                return None
+        
+        # Files are independent and pandas' C parser releases the GIL
+        with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+            frames = [f for f in executor.map(read_file, files) if f is not None]
+        
+        if not frames:
+            return pd.DataFrame({'Date': pd.Series(dtype='datetime64[ns]'),
+                                 value_column: pd.Series(dtype='float32')})
+        frame = pd.concat(frames, ignore_index=True)
+    
+    frame['Date'] = parse_dates(frame['Date'])
+    return frame
+
+
+def compute_derived_columns(pr, days_elapsed, block_factors, day_factors, initial_budget, window):
+    """
+    Compute the moving average, budget line and above-budget flags in one pass.
+    
+    Compiled with numba when it is installed (see derived_columns_kernel).
+    
+    Args:
+        pr: Array of PR values (NaN for missing days)
+        days_elapsed: Array of whole days since the budget start date
+        block_factors: Budget decay factor per whole 365-day block
+        day_factors: Budget decay factor per day within a block
+        initial_budget: Budget PR at the budget start date
+        window: Moving average window in rows (min_periods=1, NaNs skipped)
+    
+    Returns:
+        Tuple of arrays: (moving average, budget PR, above budget as 0/1)
+    """
+    n = len(pr)
+    moving_avg = np.empty(n)
+    budget = np.empty(n)
+    above = np.zeros(n, dtype=np.int64)
+    total = 0.0
+    count = 0
+    for i in range(n):
+        value = pr[i]
+        if not np.isnan(value):
+            total += value
+            count += 1
+        if i >= window:
+            dropped = pr[i - window]
+            if not np.isnan(dropped):
+                total -= dropped
+                count -= 1
+        moving_avg[i] = total / count if count > 0 else np.nan
+        
+        budget[i] = initial_budget * block_factors[days_elapsed[i] // 365] * day_factors[days_elapsed[i] % 365]
+        if value > budget[i]:
+            above[i] = 1
+    return moving_avg, budget, above
+
+
+# fastmath is left off because it lets LLVM assume there are no NaNs
+derived_columns_kernel = njit(cache=True)(compute_derived_columns) if njit is not None else None
+
+# Bump whenever the layout or dtypes of the processed data change, so caches
+# written by older code are rebuilt instead of reused
+CACHE_SCHEMA_VERSION = 3
+
+
+def last_occurrences(codes):
+    """
+    Find the position of the last occurrence of every distinct code.
+    
+    Args:
+        codes: Integer array, possibly with repeated values
+    
+    Returns:
+        Tuple of arrays: (distinct codes, position of each one's last occurrence)
+    """
+    unique_codes, reversed_first = np.unique(codes[::-1], return_index=True)
+    return unique_codes, len(codes) - 1 - reversed_first
+
+
+def build_cache_key(pr_folder, ghi_folder, pr_files, ghi_files):
+    """
+    Describe what a processed-data cache was built from.
+    
+    Args:
+        pr_folder: Path to PR data folder
+        ghi_folder: Path to GHI data folder
+        pr_files: Sorted list of PR CSV file paths
+        ghi_files: Sorted list of GHI CSV file paths
+    
+    Returns:
+        JSON-serializable dict with the schema version, resolved folders
+        and source file lists
+    """
+    return {
+        'schema_version': CACHE_SCHEMA_VERSION,
+        'pr_folder': os.path.realpath(pr_folder),
+        'ghi_folder': os.path.realpath(ghi_folder),
+        'pr_files': [os.path.realpath(f) for f in pr_files],
+        'ghi_files': [os.path.realpath(f) for f in ghi_files],
+    }
+
+
+def is_cache_fresh(cache_path, source_paths, cache_key):
+    """
+    Check whether a cache file matches its sources and is newer than all of them.
+    
+    The key the cache was written with is stored next to it in
+    `<cache_path>.json` and must equal cache_key.
+    
+    Args:
+        cache_path: Path to the cached file
+        source_paths: Files and folders the cache was built from
+        cache_key: Expected key, see build_cache_key()
+    
+    Returns:
+        True if the cache exists, was built from the same sources with the
+        same schema, and no source was modified after it
+    """
+    key_path = cache_path + '.json'
+    if not os.path.exists(cache_path) or not os.path.exists(key_path):
+        return False
+    try:
+        with open(key_path) as f:
+            if json.load(f) != cache_key:
+                return False
+    except (OSError, ValueError):
+        return False
+    cache_mtime = os.stat(cache_path).st_mtime
+    return all(os.stat(p).st_mtime < cache_mtime for p in source_paths if os.path.exists(p))
+
 
 def preprocess_data(pr_folder='PR', ghi_folder='GHI', output_csv='processed_data.csv'):
     """
     Process PR and GHI data from folder structure and combine into single CSV.
     
+    A Parquet copy of the output is kept next to the CSV and reused on later
+    runs as long as it was built from the same folders, files and schema
+    version and no source file or folder has changed since.
+    
     Args:
         pr_folder: Path to PR data folder
         ghi_folder: Path to GHI data folder
@@ -20,58 +231,72 @@ def preprocess_data(pr_folder='PR', ghi_folder='GHI', output_csv='processed_data
     """
     print("Starting data preprocessing...")
     
-    # Initialize dictionary to store data by date
-    data_dict = {}
-    
-    # Process PR files
-    pr_path = Path(pr_folder)
-    pr_files = sorted(pr_path.rglob('*.csv'))
+    # Find PR and GHI files
+    pr_files = sorted(iter_csvs(pr_folder))
+    ghi_files = sorted(iter_csvs(ghi_folder))
     
     print(f"Found {len(pr_files)} PR files")
-    
-    # Read all PR data
-    for pr_file in pr_files:
-        try:
-            pr_df = pd.read_csv(pr_file)
-            # Each file has Date and PR columns
-            for _, row in pr_df.iterrows():
-                date = row['Date']
-                pr_value = row['PR']
-                if date not in data_dict:
-                    data_dict[date] = {'Date': date, 'PR': None, 'GHI': None}
-                data_dict[date]['PR'] = pr_value
-        except Exception as e:
-            print(f"Error processing {pr_file}: {e}")
-    
-    print(f"Loaded PR data for {len(data_dict)} dates")
-    
-    # Process GHI files
-    ghi_path = Path(ghi_folder)
-    ghi_files = sorted(ghi_path.rglob('*.csv'))
-    
     print(f"Found {len(ghi_files)} GHI files")
     
-    # Read all GHI data
-    for ghi_file in ghi_files:
+    # Reuse the Parquet cache when nothing changed since it was written
+    # (folder mtimes catch added or removed files)
+    parquet_path = os.path.splitext(output_csv)[0] + '.parquet'
+    source_paths = pr_files + ghi_files + [pr_folder, ghi_folder]
+    source_paths += sorted({os.path.dirname(f) for f in pr_files + ghi_files})
+    cache_key = build_cache_key(pr_folder, ghi_folder, pr_files, ghi_files)
+    if os.path.exists(output_csv) and is_cache_fresh(parquet_path, source_paths, cache_key):
         try:
-            ghi_df = pd.read_csv(ghi_file)
-            # Each file has Date and GHI columns
-            for _, row in ghi_df.iterrows():
-                date = row['Date']
-                ghi_value = row['GHI']
-                if date not in data_dict:
-                    data_dict[date] = {'Date': date, 'PR': None, 'GHI': None}
-                data_dict[date]['GHI'] = ghi_value
+            df = pd.read_parquet(parquet_path)
+            print(f"Loaded cached data from: {parquet_path}")
+            print(f"Total rows: {len(df)}")
+            return df
         except Exception as e:
-            print(f"Error processing {ghi_file}: {e}")
-    
-    # Convert dictionary to DataFrame
-    df = pd.DataFrame(list(data_dict.values()))
-    df['Date'] = pd.to_datetime(df['Date'])
-    df = df.sort_values('Date').reset_index(drop=True)
-    
-    # Select only the required columns in the correct order
-    df = df[['Date', 'GHI', 'PR']]
+            print(f"Could not read {parquet_path} ({e}), reprocessing")
+    
+    # Read all PR data (each file has Date and PR columns)
+    pr_all = read_csv_files(pr_files, 'PR')
+    
+    # Read all GHI data (each file has Date and GHI columns)
+    ghi_all = read_csv_files(ghi_files, 'GHI')
+    
+    # Rows with a blank or unparseable date cannot be placed on the timeline
+    # (NaT would otherwise become day 0, i.e. 1970-01-01)
+    pr_bad_dates = pr_all['Date'].isna()
+    ghi_bad_dates = ghi_all['Date'].isna()
+    if pr_bad_dates.any():
+        print(f"Dropped {pr_bad_dates.sum()} PR rows with missing/unparseable dates")
+        pr_all = pr_all[~pr_bad_dates]
+    if ghi_bad_dates.any():
+        print(f"Dropped {ghi_bad_dates.sum()} GHI rows with missing/unparseable dates")
+        ghi_all = ghi_all[~ghi_bad_dates]
+    
+    # Turn dates into int32 day numbers (days since 1970-01-01) and factorize
+    # them into one shared, sorted code space for both sources
+    pr_keys = pr_all['Date'].values.astype('datetime64[D]').astype(np.int32)
+    ghi_keys = ghi_all['Date'].values.astype('datetime64[D]').astype(np.int32)
+    codes, day_keys = pd.factorize(np.concatenate([pr_keys, ghi_keys]), sort=True)
+    pr_codes, ghi_codes = codes[:len(pr_keys)], codes[len(pr_keys):]
+    
+    # Keep only the last row for each date (later files win when a date
+    # appears more than once)
+    pr_slots, pr_rows = last_occurrences(pr_codes)
+    ghi_slots, ghi_rows = last_occurrences(ghi_codes)
+    
+    print(f"Loaded PR data for {len(pr_slots)} dates")
+    
+    # Scatter each source into its slot; dates missing from a source stay NaN
+    pr_values = np.full(len(day_keys), np.nan, dtype=np.float32)
+    pr_values[pr_slots] = pr_all['PR'].to_numpy()[pr_rows]
+    ghi_values = np.full(len(day_keys), np.nan, dtype=np.float32)
+    ghi_values[ghi_slots] = ghi_all['GHI'].to_numpy()[ghi_rows]
+    
+    # Build the output straight from the column arrays, already in the
+    # required column order, so no per-row objects or extra frame copies
+    df = pd.DataFrame({
+        'Date': pd.to_datetime(day_keys, unit='D'),
+        'GHI': ghi_values,
+        'PR': pr_values,
+    })
     
     # Debug info
     print(f"\nData statistics:")
@@ -83,10 +308,24 @@ def preprocess_data(pr_folder='PR', ghi_folder='GHI', output_csv='processed_data
     
     # Save to CSV
     df.to_csv(output_csv, index=False)
+    
+    # Save Parquet cache for later runs (needs pyarrow or fastparquet), plus
+    # the key describing what it was built from
+    try:
+        df.to_parquet(parquet_path, index=False, compression='zstd')
+        with open(parquet_path + '.json', 'w') as f:
+            json.dump(cache_key, f, indent=2)
+        cache_saved = True
+    except Exception as e:
+        print(f"Skipping Parquet cache ({e})")
+        cache_saved = False
+    
     print(f"\nData preprocessing complete!")
     print(f"Total rows: {len(df)}")
     print(f"Date range: {df['Date'].min()} to {df['Date'].max()}")
     print(f"Output saved to: {output_csv}")
+    if cache_saved:
+        print(f"Cache saved to: {parquet_path}")
     
     return df
 
@@ -103,38 +342,45 @@ def generate_graph(df, start_date=None, end_date=None, output_file='pr_performan
     """
     print("\nGenerating visualization...")
     
-    # Filter data by date range if provided
-    df_plot = df.copy()
-    if start_date:
-        df_plot = df_plot[df_plot['Date'] >= pd.to_datetime(start_date)]
-    if end_date:
-        df_plot = df_plot[df_plot['Date'] <= pd.to_datetime(end_date)]
+    # Filter data by date range if provided; preprocess_data returns rows
+    # sorted by Date, so the window is found by binary search on the dates
+    # rather than by comparing every row
+    start = pd.Timestamp(start_date).to_datetime64() if start_date else None
+    end = pd.Timestamp(end_date).to_datetime64() if end_date else None
+    all_dates = df['Date'].to_numpy()
+    if df['Date'].is_monotonic_increasing:
+        lo = np.searchsorted(all_dates, start, side='left') if start is not None else 0
+        hi = np.searchsorted(all_dates, end, side='right') if end is not None else len(all_dates)
+        rows = slice(lo, hi)
+    else:
+        rows = np.ones(len(all_dates), dtype=bool)
+        if start is not None:
+            rows &= all_dates >= start
+        if end is not None:
+            rows &= all_dates <= end
     
-    print(f"Plotting {len(df_plot)} data points")
+    # Work on plain arrays for the selected rows (views when sliced) rather
+    # than on a copied DataFrame with extra columns
+    dates = all_dates[rows]
+    pr = df['PR'].to_numpy()[rows]
+    ghi = df['GHI'].to_numpy()[rows]
     
-    # Calculate 30-day moving average
-    df_plot['PR_MA_30'] = df_plot['PR'].rolling(window=30, min_periods=1).mean()
+    print(f"Plotting {len(dates)} data points")
     
     # Define color mapping for GHI values
-    def get_ghi_color(ghi):
-        if pd.isna(ghi):
-            return '#808080'  # Gray for missing data
-        elif ghi < 2:
-            return '#00008B'  # Dark blue (Navy)
-        elif 2 <= ghi < 4:
-            return '#4169E1'  # Royal blue (< 2)
-        elif 4 <= ghi < 6:
-            return '#FFA500'  # Orange (2~4)
-        else:
-            return '#8B4513'  # Brown (> 6)
-    
-    df_plot['color'] = df_plot['GHI'].apply(get_ghi_color)
+    colors = np.select(
+        [np.isnan(ghi), ghi < 2, ghi < 4, ghi < 6],
+        ['#808080',   # Gray for missing data
+         '#00008B',   # Dark blue (Navy)
+         '#4169E1',   # Royal blue (< 2)
+         '#FFA500'],  # Orange (2~4)
+        default='#8B4513')  # Brown (> 6)
     
     # Calculate dynamic budget line
     # Budget starts at 73.9 and reduces by 0.8% every year
     # Year starts from July (month 7)
-    first_date = df_plot['Date'].min()
-    last_date = df_plot['Date'].max()
+    first_date = pd.Timestamp(dates.min())
+    last_date = pd.Timestamp(dates.max())
     
     # Determine the first July reference point
     if first_date.month >= 7:
@@ -144,29 +390,56 @@ def generate_graph(df, start_date=None, end_date=None, output_file='pr_performan
     
     budget_start_date = pd.Timestamp(f'{ref_year}-07-01')
     
+    initial_budget = 73.9
+    annual_reduction = 0.008  # 0.8%
+    
     def calculate_budget_pr(date):
         """Calculate budget PR for a given date"""
         years_elapsed = (date - budget_start_date).days / 365.25
-        initial_budget = 73.9
-        annual_reduction = 0.008  # 0.8%
         budget_pr = initial_budget * ((1 - annual_reduction) ** years_elapsed)
         return budget_pr
     
-    df_plot['Budget_PR'] = df_plot['Date'].apply(calculate_budget_pr)
-    
-    # Calculate points above budget
-    df_plot['Above_Budget'] = (df_plot['PR'] > df_plot['Budget_PR']).astype(int)
-    points_above_budget = df_plot['Above_Budget'].sum()
-    total_points = len(df_plot)
+    # Same formula for every plotted day: split the day offset into whole
+    # 365-day blocks plus a remainder, so the power is only evaluated on two
+    # small lookup tables instead of once per row
+    days_elapsed = (dates.astype('datetime64[D]')
+                    - np.datetime64(budget_start_date.date(), 'D')).astype(np.int64)
+    blocks, days_in_block = np.divmod(days_elapsed, 365)
+    block_factors = (1 - annual_reduction) ** (np.arange(blocks.max(initial=0) + 1) * 365 / 365.25)
+    day_factors = (1 - annual_reduction) ** (np.arange(365) / 365.25)
+    
+    # Calculate 30-day moving average, budget PR and points above budget
+    if derived_columns_kernel is not None:
+        moving_avg, budget, above = derived_columns_kernel(
+            pr, days_elapsed, block_factors, day_factors, initial_budget, 30)
+    else:
+        moving_avg = pd.Series(pr).rolling(window=30, min_periods=1).mean().to_numpy()
+        budget = initial_budget * block_factors[blocks] * day_factors[days_in_block]
+        above = (pr > budget).astype(int)
+    points_above_budget = above.sum()
+    total_points = len(pr)
     percentage_above = (points_above_budget / total_points * 100) if total_points > 0 else 0
     
-    # Calculate average PR for different periods
-    last_7_avg = df_plot['PR'].tail(7).mean()
-    last_30_avg = df_plot['PR'].tail(30).mean()
-    last_60_avg = df_plot['PR'].tail(60).mean()
-    last_90_avg = df_plot['PR'].tail(90).mean()
-    last_365_avg = df_plot['PR'].tail(365).mean()
-    lifetime_avg = df_plot['PR'].mean()
+    # Calculate average PR for different periods from one cumulative sum
+    # over the last 365 values, newest first (NaNs are skipped like .mean())
+    recent_pr = pr[-365:][::-1].astype(float)
+    recent_valid = ~np.isnan(recent_pr)
+    recent_sums = np.cumsum(np.where(recent_valid, recent_pr, 0.0))
+    recent_counts = np.cumsum(recent_valid)
+    
+    def tail_average(days):
+        """Average PR over the last `days` rows"""
+        if len(recent_pr) == 0:
+            return np.nan
+        idx = min(days, len(recent_pr)) - 1
+        return recent_sums[idx] / recent_counts[idx] if recent_counts[idx] else np.nan
+    
+    last_7_avg = tail_average(7)
+    last_30_avg = tail_average(30)
+    last_60_avg = tail_average(60)
+    last_90_avg = tail_average(90)
+    last_365_avg = tail_average(365)
+    lifetime_avg = pd.Series(pr).mean()
     
     # Calculate budget PR values for each year
     years = []
@@ -183,16 +456,20 @@ def generate_graph(df, start_date=None, end_date=None, output_file='pr_performan
     fig, ax = plt.subplots(figsize=(14, 8), facecolor='white')
     ax.set_facecolor('white')
     
-    # Plot scatter points (PR values colored by GHI)
-    scatter = ax.scatter(df_plot['Date'], df_plot['PR'], 
-                        c=df_plot['color'], s=25, alpha=0.7, zorder=3, edgecolors='none')
+    # Plot PR points colored by GHI, one single-color marker line per GHI
+    # bucket (much cheaper to draw than a per-point colored scatter)
+    for color in pd.unique(colors):
+        bucket = colors == color
+        ax.plot(dates[bucket], pr[bucket],
+                marker='o', linestyle='', markersize=5, markeredgewidth=0,
+                color=color, alpha=0.7, zorder=3, rasterized=True)
     
     # Plot 30-day moving average (red line)
-    ax.plot(df_plot['Date'], df_plot['PR_MA_30'], 
+    ax.plot(dates, moving_avg, 
             color='#FF4444', linewidth=2.5, label='30~d moving average of PR', zorder=4)
     
     # Plot budget line (dark green)
-    ax.plot(df_plot['Date'], df_plot['Budget_PR'], 
+    ax.plot(dates, budget, 
             color='#2D5016', linewidth=2.5, label=budget_label, zorder=2)
     
     # Formatting
@@ -256,7 +533,12 @@ def generate_graph(df, start_date=None, end_date=None, output_file='pr_performan
             bbox=props, family='monospace')
     
     plt.tight_layout()
-    plt.savefig(output_file, dpi=300, bbox_inches='tight')
+    # 150 dpi keeps the report sharp at a quarter of the pixels of 300 dpi;
+    # raster outputs are also run through Pillow's size optimizer
+    save_kwargs = {}
+    if os.path.splitext(output_file)[1].lower() in ('.png', '.jpg', '.jpeg'):
+        save_kwargs['pil_kwargs'] = {'optimize': True}
+    plt.savefig(output_file, dpi=150, bbox_inches='tight', **save_kwargs)
     print(f"Graph saved to: {output_file}")
     plt.show()
 